@@ -1,30 +1,24 @@
 # ap_charts.py
 from pathlib import Path
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # فقط رندر فایل؛ بدون probing بک‌اند GUI
 import matplotlib.pyplot as plt
 
 PROC = Path("data/processed")
 REPORTS = Path("reports")
 REPORTS.mkdir(parents=True, exist_ok=True)
 
-def save_bar(df, x, y, title, fname):
-    ax = df.plot(kind="bar", x=x, y=y, rot=0, title=title, legend=False)
+def _style(ax, x, y, title):
+    ax.set_title(title)
     ax.set_xlabel(x)
     ax.set_ylabel(y)
-    plt.tight_layout()
-    out = REPORTS / fname
-    plt.savefig(out, dpi=120)
-    plt.close()
-    print("Saved:", out)
 
-def save_line(df, x, y, title, fname):
-    ax = df.plot(kind="line", x=x, y=y, marker="o", title=title, legend=False)
-    ax.set_xlabel(x)
-    ax.set_ylabel(y)
-    plt.tight_layout()
+def _save_axis(fig, ax, fname):
+    # ذخیره همان محور به صورت PNG جداگانه — بدون ساخت Figure/Axes جدید برای هر نمودار
+    extent = ax.get_tightbbox(fig.canvas.get_renderer()).transformed(fig.dpi_scale_trans.inverted())
     out = REPORTS / fname
-    plt.savefig(out, dpi=120)
-    plt.close()
+    fig.savefig(out, dpi=120, bbox_inches=extent.expanded(1.02, 1.02))
     print("Saved:", out)
 
 def main():
@@ -32,17 +26,43 @@ def main():
     top_csv   = PROC / "top_vendors.csv"
     cash_csv  = PROC / "cash_weekly.csv"
 
+    # یک Figure با سه زیرنمودار؛ init فیگور/فونت‌ها فقط یک‌بار انجام می‌شود
+    fig, axes = plt.subplots(3, 1, figsize=(8, 12))
+    rendered = []
+
     if aging_csv.exists():
         aging = pd.read_csv(aging_csv)
-        save_bar(aging, "AgingBucket", "Amount", "AP Aging — Open Invoices", "ap_aging_bar.png")
+        axes[0].bar(aging["AgingBucket"].astype(str).values, aging["Amount"].values)
+        _style(axes[0], "AgingBucket", "Amount", "AP Aging — Open Invoices")
+        rendered.append((axes[0], "ap_aging_bar.png"))
+    else:
+        axes[0].set_visible(False)
 
     if top_csv.exists():
         top = pd.read_csv(top_csv).head(10)
-        save_bar(top, "Vendor", "Amount", "Top 10 Vendors by Spend", "top_vendors_bar.png")
+        axes[1].bar(top["Vendor"].astype(str).values, top["Amount"].values)
+        _style(axes[1], "Vendor", "Amount", "Top 10 Vendors by Spend")
+        rendered.append((axes[1], "top_vendors_bar.png"))
+    else:
+        axes[1].set_visible(False)
 
     if cash_csv.exists():
         cash = pd.read_csv(cash_csv, parse_dates=["DueWeek"])
-        save_line(cash, "DueWeek", "Amount", "Weekly Cash Outflow (Open Invoices)", "cash_outflow_line.png")
+        axes[2].plot(cash["DueWeek"].values, cash["Amount"].values, marker="o")
+        _style(axes[2], "DueWeek", "Amount", "Weekly Cash Outflow (Open Invoices)")
+        rendered.append((axes[2], "cash_outflow_line.png"))
+    else:
+        axes[2].set_visible(False)
+
+    if rendered:
+        fig.tight_layout()
+        fig.canvas.draw()  # یک‌بار رندر؛ bboxهای per-axis از همین استفاده می‌کنند
+        for ax, fname in rendered:
+            _save_axis(fig, ax, fname)
+        out = REPORTS / "ap_dashboard.png"
+        fig.savefig(out, dpi=120)
+        print("Saved:", out)
+    plt.close(fig)
 
 if __name__ == "__main__":
     main()
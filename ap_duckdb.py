@@ -0,0 +1,98 @@
+# ap_duckdb.py — بک‌اند اختیاری DuckDB برای کل pipeline
+# پاکسازی + ساخت ویژگی‌ها + هر سه گزارش به صورت SQL برداری (ستونی، بدون object dtype پانداز)
+# اجرا: python ap_duckdb.py  (pip install duckdb)
+import duckdb
+
+from ap_paths import RAW, PROC, find_raw_xlsx
+
+PROC.mkdir(parents=True, exist_ok=True)
+
+ALLOWED_CCY = ("USD","EUR","GBP","CAD","AUD","JPY")
+
+def _create_clean_view(con: duckdb.DuckDBPyConnection):
+    """ویوی clean: از ap_clean.parquet اگر موجود باشد، وگرنه پاکسازی روی اکسل خام."""
+    parquet = PROC / "ap_clean.parquet"
+    if parquet.exists():
+        # CREATE VIEW پارامتر prepared نمی‌پذیرد؛ مسیر را escape می‌کنیم
+        p = str(parquet).replace("'", "''")
+        con.execute(f"CREATE OR REPLACE VIEW clean AS SELECT * FROM read_parquet('{p}')")
+        return
+
+    try:
+        xlsx = find_raw_xlsx()
+    except FileNotFoundError:
+        raise FileNotFoundError("No cleaned parquet or raw Excel found.")
+    p = str(xlsx).replace("'", "''")
+    con.execute(f"CREATE OR REPLACE VIEW raw AS SELECT * FROM read_xlsx('{p}')")
+    # همان قوانین ap_cleaning: APID، Amount>0، تاریخ‌های معتبر، ارز مجاز،
+    # و حذف «همهٔ» ردیف‌های duplicate روی کلید ترکیبی (keep=False)
+    con.execute(f"""
+        CREATE OR REPLACE VIEW clean AS
+        SELECT * FROM raw
+        WHERE APID IS NOT NULL AND trim(CAST(APID AS VARCHAR)) <> ''
+          AND TRY_CAST(Amount AS DOUBLE) > 0
+          AND InvoiceDate IS NOT NULL AND DueDate IS NOT NULL
+          AND DueDate >= InvoiceDate
+          AND trim(CAST(Currency AS VARCHAR)) IN {ALLOWED_CCY}
+        QUALIFY count(*) OVER (PARTITION BY APID, Vendor, InvoiceDate, Amount) = 1
+    """)
+
+def main():
+    con = duckdb.connect()
+    _create_clean_view(con)
+
+    # ویژگی‌ها (IsPaid / DaysPastDue / AgingBucket) — معادل _ensure_features
+    con.execute("""
+        CREATE OR REPLACE VIEW feat AS
+        SELECT *,
+            (lower(CAST(Status AS VARCHAR)) = 'paid' OR PaidDate IS NOT NULL) AS IsPaid,
+            greatest(coalesce(CASE WHEN (lower(CAST(Status AS VARCHAR)) = 'paid' OR PaidDate IS NOT NULL)
+                                   THEN datediff('day', DueDate, PaidDate)
+                                   ELSE datediff('day', DueDate, current_date) END, 0), 0) AS DaysPastDue
+        FROM clean
+    """)
+    con.execute("""
+        CREATE OR REPLACE VIEW feat2 AS
+        SELECT *,
+            CASE WHEN DaysPastDue <= 0  THEN 'Current'
+                 WHEN DaysPastDue <= 30 THEN '0–30'
+                 WHEN DaysPastDue <= 60 THEN '31–60'
+                 WHEN DaysPastDue <= 90 THEN '61–90'
+                 ELSE '>90' END AS AgingBucket
+        FROM feat
+    """)
+
+    # ترتیب bucketها باید با ترتیب categorical پانداز یکی باشد، نه ترتیب الفبایی
+    aging = con.execute("""
+        SELECT AgingBucket, sum(Amount) AS Amount, count(*) AS Count
+        FROM feat2 WHERE NOT IsPaid
+        GROUP BY 1
+        ORDER BY CASE AgingBucket
+                     WHEN 'Current' THEN 0
+                     WHEN '0–30'    THEN 1
+                     WHEN '31–60'   THEN 2
+                     WHEN '61–90'   THEN 3
+                     ELSE 4 END
+    """).fetchdf()
+    top = con.execute("""
+        SELECT Vendor, sum(Amount) AS Amount, count(*) AS CountInvoices
+        FROM feat2 GROUP BY 1 ORDER BY Amount DESC LIMIT 10
+    """).fetchdf()
+    cash = con.execute("""
+        SELECT date_trunc('week', DueDate) AS DueWeek, sum(Amount) AS Amount
+        FROM feat2 WHERE NOT IsPaid
+        GROUP BY 1 ORDER BY 1
+    """).fetchdf()
+
+    outs = []
+    for name, frame in [("aging_open.csv", aging), ("top_vendors.csv", top), ("cash_weekly.csv", cash)]:
+        out = PROC / name
+        frame.to_csv(out, index=False)
+        outs.append(out)
+
+    print("\n--- REPORTS (duckdb) ---")
+    for p in outs:
+        print("Saved:", p)
+
+if __name__ == "__main__":
+    main()
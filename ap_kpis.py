@@ -1,32 +1,61 @@
-from pathlib import Path
 import pandas as pd
 import numpy as np
 
-RAW = Path("data/raw")
-PROC = Path("data/processed")
+from ap_paths import RAW, PROC, find_raw_xlsx
+
 PROC.mkdir(parents=True, exist_ok=True)
 
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+def _read_excel(path):
+    if EXCEL_ENGINE and str(path).lower().endswith(".xlsx"):
+        try:
+            return pd.read_excel(path, engine=EXCEL_ENGINE, dtype_backend="pyarrow")
+        except Exception:
+            pass
+    return pd.read_excel(path, dtype_backend="pyarrow")
+
 def _safe_to_datetime(df: pd.DataFrame, cols):
     for c in cols:
-        if c in df.columns:
-            df[c] = pd.to_datetime(df[c], errors="coerce")
+        if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            try:
+                df[c] = pd.to_datetime(df[c], errors="coerce", format="ISO8601", cache=True)
+            except (ValueError, TypeError):
+                df[c] = pd.to_datetime(df[c], errors="coerce", cache=True)
     return df
 
 def _ensure_features(df: pd.DataFrame) -> pd.DataFrame:
     # IsPaid
     df["IsPaid"] = False
     if "Status" in df.columns:
-        df["IsPaid"] = df["IsPaid"] | df["Status"].astype(str).str.lower().eq("paid")
+        status = df["Status"]
+        if not isinstance(status.dtype, pd.CategoricalDtype):
+            # مسیر CSV/خام: یک‌بار نرمال کن؛ از parquet از قبل category کوچک است
+            status = status.astype("string").str.lower().astype("category")
+        df["IsPaid"] = df["IsPaid"] | status.eq("paid").fillna(False).astype(bool)
     if "PaidDate" in df.columns:
         df["IsPaid"] = df["IsPaid"] | df["PaidDate"].notna()
 
-    # DaysPastDue
+    # DaysPastDue — یک پاس numpy روی نمای int64 تاریخ‌ها
+    # (به جای dt.days + np.where + fillna + clip که چهار پاس کامل و float64 موقت می‌سازند)
     today = pd.Timestamp.today().normalize()
     if "DueDate" in df.columns:
-        dpd_today = (today - df["DueDate"]).dt.days
-        dpd_paid  = (df["PaidDate"] - df["DueDate"]).dt.days if "PaidDate" in df.columns else np.nan
-        df["DaysPastDue"] = np.where(df["IsPaid"], dpd_paid, dpd_today)
-        df["DaysPastDue"] = df["DaysPastDue"].fillna(0).clip(lower=0)
+        ns_per_day = 86_400_000_000_000
+        nat = np.iinfo("i8").min
+        due = df["DueDate"].to_numpy("datetime64[ns]").view("i8")
+        dpd = (np.int64(today.value) - due) // ns_per_day
+        if "PaidDate" in df.columns:
+            paid = df["PaidDate"].to_numpy("datetime64[ns]").view("i8")
+            dpd_paid = (paid - due) // ns_per_day
+            dpd_paid[paid == nat] = 0  # پرداخت‌شده بدون PaidDate → مثل fillna(0)
+            dpd = np.where(df["IsPaid"].to_numpy(dtype=bool), dpd_paid, dpd)
+        np.maximum(dpd, 0, out=dpd)
+        dpd[due == nat] = 0
+        df["DaysPastDue"] = dpd.astype("int32")
     else:
         df["DaysPastDue"] = 0
 
@@ -37,30 +66,37 @@ def _ensure_features(df: pd.DataFrame) -> pd.DataFrame:
         df["AgingBucket"] = pd.cut(df["DaysPastDue"], bins=bins, labels=labels)
     return df
 
-def _parse_terms_days(s):
-    """استخراج روز از Terms (مثلاً Net 30 → 30)."""
-    if pd.isna(s):
-        return np.nan
-    import re
-    m = re.search(r"(\d+)", str(s))
-    return int(m.group(1)) if m else np.nan
+def _parse_terms_days(terms: pd.Series) -> pd.Series:
+    """استخراج روز از Terms به صورت برداری (مثلاً Net 30 → 30)."""
+    return pd.to_numeric(
+        terms.astype("string").str.extract(r"(\d+)", expand=False),
+        errors="coerce",
+    )
 
 def load_clean_or_raw():
-    # ترجیح: ap_clean.csv
+    # ترجیح: ap_clean.parquet (ستون‌های تایپ‌شده، بدون re-parse تاریخ)، بعد CSV
+    clean_parquet = PROC / "ap_clean.parquet"
     clean_csv = PROC / "ap_clean.csv"
-    if clean_csv.exists():
-        df = pd.read_csv(clean_csv)
+    if clean_parquet.exists():
+        df = pd.read_parquet(clean_parquet)
+    elif clean_csv.exists():
+        # رشته‌های arrow به جای ستون object (یک آبجکت Python per cell)
+        df = pd.read_csv(clean_csv, dtype_backend="pyarrow")
     else:
-        # fallback: اولین اکسل موجود
-        files = sorted(RAW.glob("*.xlsx"))
-        if not files:
+        # fallback: اولین اکسل موجود (مسیر cache شده در ap_paths)
+        try:
+            df = _read_excel(find_raw_xlsx())
+        except FileNotFoundError:
             raise FileNotFoundError("No cleaned CSV or raw Excel found.")
-        df = pd.read_excel(files[0])
     df = _safe_to_datetime(df, ["InvoiceDate","DueDate","PaidDate"])
     return df
 
-def main():
-    df = load_clean_or_raw()
+def main(df=None):
+    # df از ap_run_all پاس داده می‌شود تا parquet/CSV دوباره خوانده نشود
+    if df is None:
+        df = load_clean_or_raw()
+    else:
+        df = _safe_to_datetime(df, ["InvoiceDate","DueDate","PaidDate"])
     df = _ensure_features(df)
 
     # محاسبه KPIها
@@ -85,7 +121,7 @@ def main():
 
     # تمرکز تأمین‌کننده‌ها (Top 10 share)
     if set(["Vendor","Amount"]).issubset(df.columns):
-        vendor_sum = df.groupby("Vendor")["Amount"].sum().sort_values(ascending=False)
+        vendor_sum = df.groupby("Vendor", observed=True)["Amount"].sum().sort_values(ascending=False)
         top10 = vendor_sum.head(10).sum()
         total_amt = vendor_sum.sum()
         kpis["top10_vendor_share_pct"] = float(top10 / total_amt * 100.0) if total_amt else None
@@ -116,7 +152,7 @@ def main():
 
     # ترکیبات ارزی
     if "Currency" in df.columns and "Amount" in df.columns:
-        ccy = df.groupby("Currency").agg(
+        ccy = df.groupby("Currency", observed=True).agg(
             count=("Currency","size"),
             amount=("Amount","sum")
         ).reset_index()
@@ -125,7 +161,7 @@ def main():
 
     # Terms (اگر موجود)
     if "Terms" in df.columns:
-        terms_days = df["Terms"].map(_parse_terms_days)
+        terms_days = _parse_terms_days(df["Terms"])
         if terms_days.notna().any():
             kpis["terms_days_avg"]   = float(terms_days.mean())
             kpis["terms_days_median"] = float(terms_days.median())
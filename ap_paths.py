@@ -0,0 +1,18 @@
+# ap_paths.py — مسیرهای مشترک pipeline
+from functools import lru_cache
+from pathlib import Path
+
+RAW  = Path("data/raw")
+PROC = Path("data/processed")
+
+@lru_cache(maxsize=1)
+def find_raw_xlsx() -> Path:
+    """
+    اولین فایل xlsx در data/raw.
+    نتیجه cache می‌شود تا هر مرحلهٔ pipeline دوباره دایرکتوری را scan/stat نکند؛
+    min به جای sorted چون فقط اولین فایل لازم است.
+    """
+    first = min(RAW.glob("*.xlsx"), default=None)
+    if first is None:
+        raise FileNotFoundError("No Excel file found in data/raw/")
+    return first
@@ -2,29 +2,58 @@ from pathlib import Path
 import pandas as pd
 import numpy as np
 
-PROC = Path("data/processed")
-RAW  = Path("data/raw")
+from ap_paths import RAW, PROC, find_raw_xlsx
+
 PROC.mkdir(parents=True, exist_ok=True)
 
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+def _read_excel(path):
+    if EXCEL_ENGINE and str(path).lower().endswith(".xlsx"):
+        try:
+            return pd.read_excel(path, engine=EXCEL_ENGINE, dtype_backend="pyarrow")
+        except Exception:
+            pass
+    return pd.read_excel(path, dtype_backend="pyarrow")
+
 def _safe_to_datetime(df, cols):
     for c in cols:
-        if c in df.columns:
-            df[c] = pd.to_datetime(df[c], errors="coerce")
+        if c in df.columns and not pd.api.types.is_datetime64_any_dtype(df[c]):
+            try:
+                df[c] = pd.to_datetime(df[c], errors="coerce", format="ISO8601", cache=True)
+            except (ValueError, TypeError):
+                df[c] = pd.to_datetime(df[c], errors="coerce", cache=True)
     return df
 
 def _ensure_features(df):
     df["IsPaid"] = False
     if "Status" in df.columns:
-        df["IsPaid"] = df["IsPaid"] | df["Status"].astype(str).str.lower().eq("paid")
+        status = df["Status"]
+        if not isinstance(status.dtype, pd.CategoricalDtype):
+            status = status.astype("string").str.lower().astype("category")
+        df["IsPaid"] = df["IsPaid"] | status.eq("paid").fillna(False).astype(bool)
     if "PaidDate" in df.columns:
         df["IsPaid"] = df["IsPaid"] | df["PaidDate"].notna()
 
+    # DaysPastDue در یک پاس numpy روی نمای int64 تاریخ‌ها (بدون float64 موقت)
     today = pd.Timestamp.today().normalize()
     if "DueDate" in df.columns:
-        dpd_today = (today - df["DueDate"]).dt.days
-        dpd_paid  = (df["PaidDate"] - df["DueDate"]).dt.days if "PaidDate" in df.columns else np.nan
-        df["DaysPastDue"] = np.where(df["IsPaid"], dpd_paid, dpd_today)
-        df["DaysPastDue"] = df["DaysPastDue"].fillna(0).clip(lower=0)
+        ns_per_day = 86_400_000_000_000
+        nat = np.iinfo("i8").min
+        due = df["DueDate"].to_numpy("datetime64[ns]").view("i8")
+        dpd = (np.int64(today.value) - due) // ns_per_day
+        if "PaidDate" in df.columns:
+            paid = df["PaidDate"].to_numpy("datetime64[ns]").view("i8")
+            dpd_paid = (paid - due) // ns_per_day
+            dpd_paid[paid == nat] = 0
+            dpd = np.where(df["IsPaid"].to_numpy(dtype=bool), dpd_paid, dpd)
+        np.maximum(dpd, 0, out=dpd)
+        dpd[due == nat] = 0
+        df["DaysPastDue"] = dpd.astype("int32")
     else:
         df["DaysPastDue"] = 0
 
@@ -35,21 +64,23 @@ def _ensure_features(df):
     return df
 
 def load_clean_or_raw():
+    clean_parquet = PROC / "ap_clean.parquet"
     clean_csv = PROC / "ap_clean.csv"
-    if clean_csv.exists():
-        df = pd.read_csv(clean_csv)
+    if clean_parquet.exists():
+        df = pd.read_parquet(clean_parquet)
+    elif clean_csv.exists():
+        df = pd.read_csv(clean_csv, dtype_backend="pyarrow")
     else:
-        files = sorted(RAW.glob("*.xlsx"))
-        if not files:
+        try:
+            df = _read_excel(find_raw_xlsx())
+        except FileNotFoundError:
             raise FileNotFoundError("No cleaned CSV or raw Excel found.")
-        df = pd.read_excel(files[0])
     df = _safe_to_datetime(df, ["InvoiceDate","DueDate","PaidDate"])
     df = _ensure_features(df)
     return df
 
-def report_aging_open(df: pd.DataFrame) -> Path:
-    open_df = df.loc[~df["IsPaid"]].copy()
-    grp = open_df.groupby("AgingBucket").agg(
+def report_aging_open(open_df: pd.DataFrame) -> Path:
+    grp = open_df.groupby("AgingBucket", observed=True).agg(
         Amount=("Amount","sum"),
         Count=("AgingBucket","size")
     ).reset_index().sort_values("AgingBucket")
@@ -59,7 +90,7 @@ def report_aging_open(df: pd.DataFrame) -> Path:
 
 def report_top_vendors(df: pd.DataFrame, top_n: int = 10) -> Path:
     grp = (
-        df.groupby("Vendor")
+        df.groupby("Vendor", observed=True)
           .agg(Amount=("Amount","sum"), CountInvoices=("Vendor","size"))
           .sort_values("Amount", ascending=False)
           .head(top_n)
@@ -69,9 +100,10 @@ def report_top_vendors(df: pd.DataFrame, top_n: int = 10) -> Path:
     grp.to_csv(out, index=False)
     return out
 
-def report_cash_weekly(df: pd.DataFrame) -> Path:
-    open_df = df.loc[~df["IsPaid"]].copy()
-    open_df["DueWeek"] = open_df["DueDate"].dt.to_period("W").dt.start_time
+def report_cash_weekly(open_df: pd.DataFrame) -> Path:
+    # شروع هفته (دوشنبه) بدون ساخت PeriodIndex — فقط تفریق برداری روی datetime64
+    due = open_df["DueDate"]
+    open_df["DueWeek"] = due.dt.normalize() - pd.to_timedelta(due.dt.dayofweek, unit="D")
     grp = (
         open_df.groupby("DueWeek")["Amount"]
                .sum()
@@ -82,14 +114,22 @@ def report_cash_weekly(df: pd.DataFrame) -> Path:
     grp.to_csv(out, index=False)
     return out
 
-def main():
-    df = load_clean_or_raw()
+def main(df=None):
+    # df از ap_run_all پاس داده می‌شود تا parquet/CSV دوباره خوانده نشود
+    if df is None:
+        df = load_clean_or_raw()
+    else:
+        df = _safe_to_datetime(df, ["InvoiceDate","DueDate","PaidDate"])
+        df = _ensure_features(df)
     # اطمینان از وجود ستون Amount
     if "Amount" not in df.columns:
         raise ValueError("Column 'Amount' is required for reports.")
-    p1 = report_aging_open(df)
+    # ماسک فاکتورهای باز را یک‌بار می‌سازیم؛ هر سه گزارش از همین اسلایس استفاده می‌کنند
+    open_cols = [c for c in ["Vendor","Amount","AgingBucket","DueDate"] if c in df.columns]
+    open_df = df.loc[~df["IsPaid"], open_cols].copy()
+    p1 = report_aging_open(open_df)
     p2 = report_top_vendors(df, top_n=10)
-    p3 = report_cash_weekly(df)
+    p3 = report_cash_weekly(open_df)
 
     print("\n--- REPORTS ---")
     print("Saved:", p1)
@@ -1,21 +1,20 @@
 # ap_run_all.py
-import subprocess, sys
+# اجرای درون-پردازشی: بدون spawn چهار مفسر جدید (هرکدام ~1-2s import pandas/numpy/matplotlib)
+# و بدون سه بار re-read خروجی پاک از دیسک — DataFrame پاک‌شده مستقیم پاس داده می‌شود.
+import ap_cleaning
+import ap_kpis
+import ap_reports
+import ap_charts
 
-def run(pyfile):
-    print(f"\n=== Running: {pyfile} ===")
-    cmd = [sys.executable, pyfile]
-    subprocess.check_call(cmd)
+def run(name, fn, *args):
+    print(f"\n=== Running: {name} ===")
+    return fn(*args)
 
 def main():
-    # در صورت داشتن نام‌های متفاوت، این لیست را مطابق فایل‌های خودت تنظیم کن
-    steps = [
-        "ap_cleaning.py",  # خروجی: data/processed/ap_clean.csv
-        "ap_kpis.py",      # خروجی: data/processed/kpis_summary.csv/json و ...
-        "ap_reports.py",   # خروجی: aging_open.csv, top_vendors.csv, cash_weekly.csv
-        "ap_charts.py"     # خروجی: PNG ها در reports/
-    ]
-    for s in steps:
-        run(s)
+    df = run("ap_cleaning", ap_cleaning.main)
+    run("ap_kpis", ap_kpis.main, df)
+    run("ap_reports", ap_reports.main, df)
+    run("ap_charts", ap_charts.main)
 
 if __name__ == "__main__":
     main()
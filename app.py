@@ -1,25 +1,46 @@
 # app.py — AP Analysis Dashboard (Streamlit)
-from pathlib import Path
+import io
 import pandas as pd
 import numpy as np
 import streamlit as st
 
-RAW  = Path("data/raw")
-PROC = Path("data/processed")
+from ap_paths import RAW, PROC, find_raw_xlsx
+
 PROC.mkdir(parents=True, exist_ok=True)
 
 ALLOWED_CCY = {"USD","EUR","GBP","CAD","AUD","JPY"}
 
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
 # ---------- Utilities ----------
+def _read_excel(path):
+    # calamine is a single-pass xlsx parser — much faster/leaner than openpyxl
+    if EXCEL_ENGINE and str(path).lower().endswith(".xlsx"):
+        try:
+            return pd.read_excel(path, engine=EXCEL_ENGINE, dtype_backend="pyarrow")
+        except Exception:
+            pass
+    return pd.read_excel(path, dtype_backend="pyarrow")
+
 def _find_xlsx():
-    files = sorted(RAW.glob("*.xlsx"))
-    if not files:
+    try:
+        return find_raw_xlsx()
+    except FileNotFoundError:
         st.error("No Excel file found in data/raw/. Please put your AP .xlsx there.")
         st.stop()
-    return files[0]
 
 def _to_datetime(s):
-    return pd.to_datetime(s, errors="coerce")
+    if pd.api.types.is_datetime64_any_dtype(s):
+        return s
+    # explicit format skips inference; cache parses each distinct date once
+    try:
+        return pd.to_datetime(s, errors="coerce", format="ISO8601", cache=True)
+    except (ValueError, TypeError):
+        return pd.to_datetime(s, errors="coerce", cache=True)
 
 def _clean(df: pd.DataFrame) -> pd.DataFrame:
     # 1) APID present
@@ -38,51 +59,90 @@ def _clean(df: pd.DataFrame) -> pd.DataFrame:
     if "Currency" in df.columns:
         df["Currency"] = df["Currency"].astype(str).str.strip()
         df = df[df["Currency"].isin(ALLOWED_CCY)]
-    # 6) drop duplicates on composite key
-    df["CompositeKey"] = (
-        df["APID"].astype(str) + "|" +
-        df["Vendor"].astype(str) + "|" +
-        df["InvoiceDate"].astype(str) + "|" +
-        df["Amount"].astype(str)
-    )
-    df = df.drop_duplicates(subset="CompositeKey", keep="first").drop(columns=["CompositeKey"])
+    # 6) drop duplicates on the typed composite key (no string concatenation)
+    df = df.drop_duplicates(subset=["APID","Vendor","InvoiceDate","Amount"], keep="first")
     return df
 
 @st.cache_data
 def load_data():
+    # compute_features runs in here so features are cached too —
+    # reruns on widget interaction hit the cache instead of recomputing over N rows
+    clean_parquet = PROC / "ap_clean.parquet"
     clean_csv = PROC / "ap_clean.csv"
+    if clean_parquet.exists():
+        # parquet keeps dates typed — no re-parse needed
+        df = pd.read_parquet(clean_parquet)
+        return compute_features(df), True  # already cleaned
     if clean_csv.exists():
-        df = pd.read_csv(clean_csv, parse_dates=["InvoiceDate","DueDate","PaidDate"])
-        return df, True  # already cleaned
+        df = pd.read_csv(clean_csv, dtype_backend="pyarrow")
+        for c in ["InvoiceDate","DueDate","PaidDate"]:
+            if c in df.columns:
+                df[c] = _to_datetime(df[c])
+        return compute_features(df), True  # already cleaned
     # otherwise read raw and clean on the fly
     xlsx = _find_xlsx()
-    df = pd.read_excel(xlsx)
+    df = _read_excel(xlsx)
     df = _clean(df)
     # persist for reuse
     df.to_csv(clean_csv, index=False)
-    return df, False
+    return compute_features(df), False
 
 def compute_features(df: pd.DataFrame) -> pd.DataFrame:
     # IsPaid flag
     df["IsPaid"] = False
     if "Status" in df.columns:
-        df["IsPaid"] = df["IsPaid"] | df["Status"].astype(str).str.lower().eq("paid")
+        status = df["Status"]
+        if not isinstance(status.dtype, pd.CategoricalDtype):
+            # CSV/raw path: normalize once; parquet already carries a small category
+            status = status.astype("string").str.lower().astype("category")
+        df["IsPaid"] = df["IsPaid"] | status.eq("paid").fillna(False).astype(bool)
     if "PaidDate" in df.columns:
         df["IsPaid"] = df["IsPaid"] | df["PaidDate"].notna()
-    # DaysPastDue
+    # DaysPastDue — one fused numpy pass over the int64 view of the dates
+    # (replaces dt.days + np.where + clip, which made a temp float64 array each)
     today = pd.Timestamp.today().normalize()
-    dpd_today = (today - df["DueDate"]).dt.days
-    dpd_paid  = (df["PaidDate"] - df["DueDate"]).dt.days if "PaidDate" in df.columns else 0
-    arr = np.where(df["IsPaid"], dpd_paid, dpd_today).astype("float")
-    arr = arr.clip(min=0)   # به جای clip(lower=0)
-    df["DaysPastDue"] = arr
-    
+    ns_per_day = 86_400_000_000_000
+    nat = np.iinfo("i8").min
+    due = df["DueDate"].to_numpy("datetime64[ns]").view("i8")
+    dpd = (np.int64(today.value) - due) // ns_per_day
+    if "PaidDate" in df.columns:
+        paid = df["PaidDate"].to_numpy("datetime64[ns]").view("i8")
+        dpd_paid = (paid - due) // ns_per_day
+        dpd_paid[paid == nat] = 0
+        dpd = np.where(df["IsPaid"].to_numpy(dtype=bool), dpd_paid, dpd)
+    np.maximum(dpd, 0, out=dpd)
+    dpd[due == nat] = 0
+    df["DaysPastDue"] = dpd.astype("int32")
+
+
     # Aging buckets
     bins   = [-1, 0, 30, 60, 90, np.inf]
     labels = ["Current","0–30","31–60","61–90",">90"]
     df["AgingBucket"] = pd.cut(df["DaysPastDue"], bins=bins, labels=labels)
     return df
 
+@st.cache_data
+def apply_filters(df: pd.DataFrame, d_from, d_to, vendors: tuple, ccys: tuple) -> pd.DataFrame:
+    # cached per filter selection so widget reruns don't re-mask the full frame
+    mask = (df["InvoiceDate"].dt.date >= d_from) & (df["InvoiceDate"].dt.date <= d_to)
+    if vendors:
+        mask &= df["Vendor"].astype(str).isin(vendors)
+    if ccys:
+        mask &= df["Currency"].isin(ccys)
+    return df.loc[mask].copy()
+
+@st.cache_data
+def _to_csv_bytes(df: pd.DataFrame) -> bytes:
+    # serialized once per filter result — reruns reuse the cached bytes
+    # instead of re-encoding the whole frame on every widget event
+    return df.to_csv(index=False).encode("utf-8")
+
+@st.cache_data
+def _to_parquet_bytes(df: pd.DataFrame) -> bytes:
+    buf = io.BytesIO()
+    df.to_parquet(buf, engine="pyarrow", compression="snappy")
+    return buf.getvalue()
+
 def kpi_block(df: pd.DataFrame):
     total = len(df)
     open_mask = ~df["IsPaid"]
@@ -99,7 +159,6 @@ st.set_page_config(page_title="AP Analysis (D365-style)", layout="wide")
 st.title("Accounts Payable — Interactive Dashboard")
 
 df, from_processed = load_data()
-df = compute_features(df)
 
 with st.sidebar:
     st.header("Filters")
@@ -116,13 +175,8 @@ with st.sidebar:
     else:
         sel_ccy = []
 
-# apply filters
-mask = (df["InvoiceDate"].dt.date >= d_from) & (df["InvoiceDate"].dt.date <= d_to)
-if sel_vendors:
-    mask &= df["Vendor"].astype(str).isin(sel_vendors)
-if sel_ccy:
-    mask &= df["Currency"].isin(sel_ccy)
-df_f = df.loc[mask].copy()
+# apply filters (cached per selection)
+df_f = apply_filters(df, d_from, d_to, tuple(sel_vendors), tuple(sel_ccy))
 
 st.subheader("KPIs")
 kpi_block(df_f)
@@ -130,18 +184,20 @@ kpi_block(df_f)
 # Aging (Open)
 st.subheader("Aging — Open Invoices")
 open_df = df_f.loc[~df_f["IsPaid"]]
-aging = open_df.groupby("AgingBucket")["Amount"].sum().reindex(["Current","0–30","31–60","61–90",">90"]).fillna(0)
+aging = open_df.groupby("AgingBucket", observed=True)["Amount"].sum().reindex(["Current","0–30","31–60","61–90",">90"]).fillna(0)
 st.bar_chart(aging)
 
 # Top Vendors
 st.subheader("Top Vendors by Spend")
-top_vendors = df_f.groupby("Vendor")["Amount"].sum().sort_values(ascending=False).head(10)
+top_vendors = df_f.groupby("Vendor", observed=True)["Amount"].sum().sort_values(ascending=False).head(10)
 st.bar_chart(top_vendors)
 
 # Cash weekly
 st.subheader("Cash Outflow by Week (Open)")
 if not open_df.empty:
-    open_df["DueWeek"] = open_df["DueDate"].dt.to_period("W").dt.start_time
+    # week start (Monday) via vectorized datetime64 subtraction — no PeriodIndex
+    due = open_df["DueDate"]
+    open_df["DueWeek"] = due.dt.normalize() - pd.to_timedelta(due.dt.dayofweek, unit="D")
     cash_weekly = open_df.groupby("DueWeek")["Amount"].sum().reset_index().sort_values("DueWeek")
     st.line_chart(cash_weekly.set_index("DueWeek"))
 else:
@@ -150,7 +206,9 @@ else:
 # Data table + downloads
 st.subheader("Data (filtered)")
 st.dataframe(df_f.head(200))
-st.download_button("Download filtered CSV", df_f.to_csv(index=False).encode("utf-8"), file_name="ap_filtered.csv")
+dl1, dl2 = st.columns(2)
+dl1.download_button("Download filtered CSV", _to_csv_bytes(df_f), file_name="ap_filtered.csv")
+dl2.download_button("Download filtered Parquet", _to_parquet_bytes(df_f), file_name="ap_filtered.parquet")
 
 # Badges
 st.caption(f"{'Loaded from processed' if from_processed else 'Cleaned from raw'} • Rows: {len(df):,}")
@@ -1,11 +1,16 @@
-from pathlib import Path
 import pandas as pd
 
-p = Path("data/raw")
-files = list(p.glob("*.xlsx"))
+from ap_paths import find_raw_xlsx
 
-file_path = files[0]
+file_path = find_raw_xlsx()
 print("Using file:", file_path)
 
-df = pd.read_excel(file_path)
+try:
+    # calamine parses the xlsx in one streaming pass instead of building a full DOM
+    from python_calamine import CalamineWorkbook
+    rows = CalamineWorkbook.from_path(file_path).get_sheet_by_index(0).to_python()
+    df = pd.DataFrame(rows[1:], columns=rows[0])
+except Exception:
+    df = pd.read_excel(file_path, dtype_backend="pyarrow")
+
 print(df.head())